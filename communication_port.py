@@ -15,14 +15,39 @@ Defines the API to implement a communication port
 """
 from enum import Enum
 from typing import Callable
+from concurrent.futures import Future
+import collections
+import errno
+import itertools
 import logging
+import os
+import selectors
+import socket
+import struct
 import zmq
 import pickle
 import threading
-from parse import *
-import time
+import weakref
+from urllib.parse import urlsplit
 
 USE_PORT = "zmq"  # Default definition is "zmq", also we can choose "socket" to use socket send messages.
+PICKLE_PROTOCOL = pickle.HIGHEST_PROTOCOL  # The default protocol (0) is the slowest and the biggest on the wire.
+
+# A context is heavy to create (I/O thread, inproc mailboxes), all the ports share the process one.
+_ZMQ_CTX = zmq.Context.instance()
+
+# Each request carries an id that its reply echoes back, so that several requests can be in flight.
+# zmq sends it in a header frame with the number of out-of-band buffer frames following the payload,
+# the "socket" backend prefixes each message with it and the payload size.
+_ZMQ_HEADER = struct.Struct("!QH")
+_SOCKET_HEADER = struct.Struct("!QI")
+SEND_BATCH_SIZE = 32  # Maximum number of queued requests written with a single send_multipart.
+
+# The listening ports of this process by TCP port: a sending port targeting one of them
+# hands its requests over in memory instead of pickling them through the loopback.
+_LOCAL_LISTENERS = weakref.WeakValueDictionary()
+_LOCAL_HOSTS = ("localhost", "127.0.0.1")
+USE_LOCAL_SHORTCUT = True  # False sends the requests to the listeners of this process through the sockets too.
 
 
 class CommunicationMode(Enum):
@@ -32,6 +57,56 @@ class CommunicationMode(Enum):
     TCP_RECV = 3
 
 
+class SerializedMessage(object):
+    """A message pickled once for all, for the messages sent many times like
+    the answers of a discovery server.
+
+    The ports accept it wherever they accept a dict: the TCP ports send its
+    `payload` without pickling it again and the callbacks receive its `data`.
+    """
+    __slots__ = ('data', 'payload')
+
+    def __init__(self, data: dict):
+        self.data = data
+        self.payload = pickle.dumps(data, PICKLE_PROTOCOL)
+
+
+def _dumps(message, buffers=None):
+    """Pickles message. With a buffers list, the large binary data it holds (numpy
+    arrays, pickle.PickleBuffer) is appended to it instead of being copied in the payload"""
+    if isinstance(message, SerializedMessage):
+        return message.payload
+    if buffers is None:
+        return pickle.dumps(message, PICKLE_PROTOCOL)
+    return pickle.dumps(message, PICKLE_PROTOCOL, buffer_callback=buffers.append)
+
+
+def _zmq_frames(request_id, message):
+    """The frames of a message of the "zmq" backend: header, payload and the
+    out-of-band buffers, which zmq sends without copying them"""
+    buffers = []
+    payload = _dumps(message, buffers)
+    return [_ZMQ_HEADER.pack(request_id, len(buffers)), payload] + [b.raw() for b in buffers]
+
+
+def _message_data(message):
+    if isinstance(message, SerializedMessage):
+        return message.data
+    return message
+
+
+def _set_result(future, result):
+    """Resolves the future of a request unless its caller cancelled it meanwhile"""
+    if future.set_running_or_notify_cancel():
+        future.set_result(result)
+
+
+def _set_exception(future, exc):
+    """Fails the future of a request unless its caller cancelled it meanwhile"""
+    if future.set_running_or_notify_cancel():
+        future.set_exception(exc)
+
+
 class CommunicationPort(object):
     """ The communication port can hold a connection to a ServiceInterface through several
     types of communication listed in CommunicationMode
@@ -79,6 +154,7 @@ class CommunicationPort(object):
             self.task = self._start_listening(self.target_address)
         if self._communication_mode == CommunicationMode.TCP_SEND:
             self.soc = self._start_sending()
+            self.task = SendChannel(self.soc)
         self._name = ""
         self.recv = False
 
@@ -114,7 +190,11 @@ class CommunicationPort(object):
     def target_port(self, port):
         self._target_port = port
         if self._communication_mode == CommunicationMode.TCP_SEND:
-            self.soc.connect(self._target_port)
+            listener = _local_listener(self._target_port)
+            if listener is not None:
+                self.task.connect_local(listener, self._target_port)
+            else:
+                self.task.connect(self._target_port)
 
     def is_ready(self):
         port_is_ref = isinstance(self._target_port, CommunicationPort)
@@ -133,19 +213,44 @@ class CommunicationPort(object):
         return res
 
     def send(self, data: dict):
-        """send with req rep pattern"""
+        """send with req rep pattern
+
+        Returns:
+            concurrent.futures.Future:
+                In TCP_SEND mode, the future of the reply. Several requests can be
+                in flight at the same time. None in FUNCTION_CALL mode. After an I/O
+                error of the socket the port is broken: the futures fail with that error.
+
+        With the "zmq" backend the large buffers of data (numpy arrays, pickle.PickleBuffer)
+        are sent without being copied: they must not be modified until the reply comes back.
+        """
         if not self.is_ready():
             raise RuntimeError("{}: communication ports are not ready".format(self.port_name))
         elif self._communication_mode == CommunicationMode.FUNCTION_CALL_SEND:
             # print("{}: calliong receive for request".format(self.port_name))
             self._target_port.receive(data, respond_function=self.receive)
         elif self._communication_mode == CommunicationMode.TCP_SEND:
-            self.soc.send(pickle.dumps(data))
-            self.task = ReceiveThread(self.soc)
-            self.task.start()
+            return self.task.submit(data)
         else:
             raise AttributeError("communicationMode needs to be FUNCTION_CALL_SEND or TCP_SEND")
 
+    def send_batch(self, items):
+        """send several requests at once, in TCP_SEND mode they are written
+        to the socket together instead of one system call per request
+
+        Returns:
+            List[concurrent.futures.Future]:
+                the futures of the replies, in the order of items
+        """
+        if self._communication_mode == CommunicationMode.TCP_SEND and self.is_ready():
+            return self.task.submit_many(items)
+        return [self.send(data) for data in items]
+
+    def close(self):
+        """Closes the socket of a TCP port: for TCP_SEND the requests still
+        waiting for a reply are cancelled, for TCP_RECV the listening thread stops"""
+        if self._communication_mode in (CommunicationMode.TCP_SEND, CommunicationMode.TCP_RECV):
+            self.task.close()
 
     def receive(self, data: dict, respond_function=None):
         """
@@ -155,10 +260,11 @@ class CommunicationPort(object):
                 request for a REQ-REP pattern 
                 when in FUNCTION_CALL mode. if None, no Rep is possible
         """
+        data = _message_data(data)
         if respond_function:
                 # print("{}: calling callback with respond function".format(self.port_name))
             self._receive_callback(data, respond_function=respond_function)
-            print("1",data)
+            self._log.debug("%s: request %r", self.port_name, data)
         else:
                 # print("{}: calling callback without respond function".format(self.port_name))
             if self._communication_mode == CommunicationMode.TCP_SEND:
@@ -171,12 +277,12 @@ class CommunicationPort(object):
             if self._communication_mode == CommunicationMode.FUNCTION_CALL_RECV \
                     or self._communication_mode == CommunicationMode.FUNCTION_CALL_SEND:
                 self._receive_callback(data)
-                print("3", data)
+                self._log.debug("%s: received %r", self.port_name, data)
 
     def receive_tcp(self,data: dict):
         if self._communication_mode == CommunicationMode.TCP_RECV:
-            self._receive_callback_tcp(data)
-            print("2", data)
+            self._receive_callback_tcp(_message_data(data))
+            self._log.debug("%s: reply %r", self.port_name, data)
             self.task.send_message (data)
 
     def _start_listening(self, address):
@@ -187,10 +293,8 @@ class CommunicationPort(object):
 
     def _start_sending(self):
         if USE_PORT == "zmq":
-            context = zmq.Context()
-            soc = context.socket(zmq.REQ)
+            soc = _ZMQ_CTX.socket(zmq.DEALER)
         elif USE_PORT == "socket":
-            import socket
             soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         else:
             raise ValueError("USE_PORT needs to be zmq or socket")
@@ -198,40 +302,436 @@ class CommunicationPort(object):
         return soc
 
 
-class ReceiveThread(threading.Thread):
+def _split_address(address):
+    """Splits an address like "tcp://localhost:5668" in its target and port (int).
+    A (target, port) tuple, the address of a ListenThread of the "socket" backend,
+    is also accepted."""
+    if isinstance(address, tuple):
+        target, port = address
+        return target, int(port)
+    url = urlsplit(address)
+    if url.scheme != "tcp" or not url.hostname or url.port is None:
+        raise ValueError("address isn't correct, it needs to be like tcp://localhost:5668")
+    return url.hostname, url.port
+
+
+def _local_listener(address):
+    """Returns the ListenThread of this process listening on address, None if there is none
+    or if the address isn't a TCP one (zmq also connects to ipc:// or inproc:// endpoints)"""
+    if not USE_LOCAL_SHORTCUT:
+        return None
+    if isinstance(address, str) and urlsplit(address).scheme != "tcp":
+        return None
+    target, port = _split_address(address)
+    if target not in _LOCAL_HOSTS:
+        return None
+    return _LOCAL_LISTENERS.get(port)
+
+
+def _zmq_messages(frames):
+    """Splits the frames received by the "zmq" backend, which can hold several
+    messages, in a list of (request id, unpickled data)"""
+    messages = []
+    i = 0
+    while i < len(frames):
+        request_id, nbuffers = _ZMQ_HEADER.unpack(frames[i].buffer)
+        buffers = [f.buffer for f in frames[i + 2:i + 2 + nbuffers]]
+        messages.append((request_id, pickle.loads(frames[i + 1].buffer, buffers=buffers)))
+        i += 2 + nbuffers
+    return messages
+
+
+def _pop_socket_messages(buffer):
+    """Removes the complete messages of the "socket" backend from the start of
+    buffer (a bytearray) and returns them as a list of (request id, payload)"""
+    messages = []
+    offset = 0
+    while len(buffer) - offset >= _SOCKET_HEADER.size:
+        request_id, size = _SOCKET_HEADER.unpack_from(buffer, offset)
+        end = offset + _SOCKET_HEADER.size + size
+        if len(buffer) < end:
+            break
+        messages.append((request_id, bytes(buffer[offset + _SOCKET_HEADER.size:end])))
+        offset = end
+    del buffer[:offset]
+    return messages
+
+
+class _IOLoop(threading.Thread):
+    """The thread doing the socket I/O of all the TCP_SEND ports of the process.
+
+    It is the only thread using their sockets, which zmq does not allow to share between
+    threads: the ports `schedule` their channel when they have something to send, and the
+    loop polls all the connected sockets at once for the replies.
+
+    The loop never blocks on a socket: a channel which can't write all its requests
+    keeps the rest and asks to be polled for POLLOUT, so one stalled port does not
+    stop the others.
+    """
+    def __init__(self):
+        super(_IOLoop, self).__init__(name="CommunicationPortIO", daemon=True)
+        self._log = logging.getLogger(__name__)
+        self._scheduled = collections.deque()
+        self._channels = {}
+        self._wake_rx, self._wake_tx = socket.socketpair()
+        self._wake_tx.setblocking(False)
+        self._poller = zmq.Poller()
+        self._poller.register(self._wake_rx.fileno(), zmq.POLLIN)
+
+    def schedule(self, channel):
+        self._scheduled.append(channel)
+        try:
+            self._wake_tx.send(b"\0")
+        except BlockingIOError:
+            pass  # the loop has not consumed the previous wake ups yet
+
+    def register(self, channel, flags=zmq.POLLIN):
+        """Polls the socket of channel for flags, registering it again updates them"""
+        self._channels[channel.poll_key] = channel
+        self._poller.register(channel.poll_key, flags)
+
+    def unregister(self, channel):
+        if self._channels.pop(channel.poll_key, None) is not None:
+            self._poller.unregister(channel.poll_key)
+
+    def run(self):
+        while True:
+            events = dict(self._poller.poll())
+            if self._wake_rx.fileno() in events:
+                self._wake_rx.recv(4096)
+                while self._scheduled:
+                    channel = self._scheduled.popleft()
+                    self._handle(channel, channel.flush)
+            for key, flags in events.items():
+                channel = self._channels.get(key)
+                if channel is None:
+                    continue
+                if flags & (zmq.POLLOUT | zmq.POLLERR):
+                    self._handle(channel, channel.writable)
+                if flags & zmq.POLLIN and self._channels.get(key) is channel:
+                    self._handle(channel, channel.read_replies)
+
+    def _handle(self, channel, method):
+        """Runs the I/O method of a channel, an error only breaks that channel"""
+        try:
+            method()
+        except Exception as exc:
+            self._log.exception("I/O error on a communication port")
+            self.unregister(channel)
+            channel.fail_pending(exc)
+
+
+_IO_LOOP = None
+_IO_LOOP_LOCK = threading.Lock()
+
+
+def _io_loop():
+    """Returns the I/O loop of the process, started on the first call"""
+    global _IO_LOOP
+    with _IO_LOOP_LOCK:
+        if _IO_LOOP is None:
+            _IO_LOOP = _IOLoop()
+            _IO_LOOP.start()
+    return _IO_LOOP
+
+
+class SendChannel(object):
+    """Requests and replies of a TCP_SEND port.
+
+    `submit` queues a request and schedules the channel on the I/O loop, which
+    sends it and resolves the future of the request when the reply with the same
+    request id comes back. The last reply received is also kept in `data`,
+    `recv` and the `_recv_event` to wait for it are set. All the ports share the
+    single I/O loop thread.
+
+    When the target listens in this same process, `connect_local` makes the
+    requests and replies go through memory: they are neither pickled nor
+    sent on a socket, so like in FUNCTION_CALL mode both ends share the dicts.
+    Once that listener is closed, the requests go to the listener bound to the
+    same address in its place, or through the socket if there is none.
+    """
     def __init__(self, soc):
-        super(ReceiveThread, self).__init__()
         self.soc = soc
         self.data = None
         self.recv = False
-    def run(self):
-        self.data = pickle.loads(self.soc.recv())
+        self._recv_event = threading.Event()
+        self._outbox = collections.deque()
+        self._connections = collections.deque()
+        self._pending = {}
+        self._request_ids = itertools.count()
+        self._buffer = bytearray()
+        self._unsent = None  # the frames (zmq) or bytes (socket) of a batch not written yet
+        self._connected = False
+        self._connecting = False
+        self._poll_flags = 0
+        self._closing = False
+        self._closed = False
+        self._failed = None  # the I/O error which broke the channel
+        self._local = None  # weak reference to the listener of connect_local
+        self._local_address = None
+        self._local_pending = set()
+        # the backend of the socket, USE_PORT may have changed since it was created
+        self._zmq = isinstance(soc, zmq.Socket)
+        if not self._zmq:
+            soc.setblocking(False)
+        # zmq.Poller reports plain sockets by their file descriptor
+        self.poll_key = soc if self._zmq else soc.fileno()
+        self._loop = _io_loop()
+
+    def connect(self, address):
+        if not self._zmq:
+            # resolved by the caller: a DNS lookup in the I/O loop would stall all the ports
+            target, port = _split_address(address)
+            address = socket.getaddrinfo(target, port, socket.AF_INET, socket.SOCK_STREAM)[0][4]
+        self._connections.append(address)
+        self._loop.schedule(self)
+
+    def connect_local(self, listener, address):
+        self._local = weakref.ref(listener)
+        self._local_address = address
+
+    def submit(self, data: dict) -> Future:
+        future = self._queue(data)
+        self._loop.schedule(self)
+        return future
+
+    def submit_many(self, items):
+        futures = [self._queue(data) for data in items]
+        self._loop.schedule(self)
+        return futures
+
+    def _queue(self, data):
+        if self._closing:
+            raise RuntimeError("the port has been closed")
+        future = Future()
+        listener = self._local_target()
+        if listener is not None:
+            self.recv = False
+            self._recv_event.clear()
+            self._local_pending.add(future)
+            listener.submit_local(data, lambda reply: self._deliver_local(future, reply),
+                                  lambda exc: self._fail_local(future, exc))
+            return future
+        if self._failed is not None:
+            future.set_exception(self._failed)
+            return future
+        request_id = next(self._request_ids)
+        self._pending[request_id] = future
+        if self._failed is not None and self._pending.pop(request_id, None) is not None:
+            # broken meanwhile, after fail_pending emptied _pending
+            future.set_exception(self._failed)
+            return future
+        self.recv = False
+        self._recv_event.clear()
+        if self._zmq:
+            self._outbox.append(_zmq_frames(request_id, data))
+        else:
+            payload = _dumps(data)
+            self._outbox.append([_SOCKET_HEADER.pack(request_id, len(payload)), payload])
+        return future
+
+    def _local_target(self):
+        """Returns the listener the requests are handed to in memory, None to send them on the socket"""
+        if self._local is None:
+            return None
+        listener = self._local()
+        if listener is None or listener._closing:
+            listener = _local_listener(self._local_address)
+            if listener is None:
+                self._local = None
+                self.connect(self._local_address)
+                return None
+            self._local = weakref.ref(listener)
+        return listener
+
+    def close(self):
+        self._closing = True
+        while self._local_pending:
+            self._local_pending.pop().cancel()
+        self._loop.schedule(self)
+
+    # The methods below are only called from the I/O loop thread
+
+    def flush(self):
+        if self._closed:
+            return
+        if self._closing:
+            self._shutdown()
+            return
+        if self._failed is not None:
+            return
+        while self._connections:
+            self._connect(self._connections.popleft())
+        if not self._connected:
+            return  # the requests are sent once target_port is set
+        if self._zmq:
+            blocked = self._write_zmq()
+        else:
+            blocked = self._connecting or self._write_socket()
+        flags = zmq.POLLIN | (zmq.POLLOUT if blocked else 0)
+        if flags != self._poll_flags:
+            self._poll_flags = flags
+            self._loop.register(self, flags)
+
+    def writable(self):
+        """Called when the socket can be written again, or a connection failed"""
+        if self._connecting:
+            self._connecting = False
+            error = self.soc.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+            if error:
+                raise OSError(error, os.strerror(error))
+        self.flush()
+
+    def _connect(self, address):
+        if self._zmq:
+            self.soc.connect(address)
+        else:
+            error = self.soc.connect_ex(address)
+            if error not in (0, errno.EINPROGRESS):
+                raise OSError(error, os.strerror(error))
+            # writable once connected
+            self._connecting = error != 0
+        self._connected = True
+
+    def _write_zmq(self):
+        """Sends the queued requests without blocking, returns True if some are left"""
+        # the requests queued while the loop was busy are coalesced in one write
+        while self._unsent or self._outbox:
+            if not self._unsent:
+                self._unsent = []
+                for _ in range(min(len(self._outbox), SEND_BATCH_SIZE)):
+                    self._unsent += self._outbox.popleft()
+            try:
+                self.soc.send_multipart(self._unsent, zmq.NOBLOCK, copy=False)
+            except zmq.Again:
+                return True
+            self._unsent = None
+        return False
+
+    def _write_socket(self):
+        """Sends the queued requests without blocking, returns True if some are left"""
+        while self._unsent or self._outbox:
+            if not self._unsent:
+                frames = []
+                for _ in range(min(len(self._outbox), SEND_BATCH_SIZE)):
+                    frames += self._outbox.popleft()
+                self._unsent = memoryview(b"".join(frames))
+            try:
+                sent = self.soc.send(self._unsent)
+            except BlockingIOError:
+                return True
+            self._unsent = self._unsent[sent:]
+        return False
+
+    def read_replies(self):
+        if self._zmq:
+            while True:
+                try:
+                    frames = self.soc.recv_multipart(zmq.NOBLOCK, copy=False)
+                except zmq.Again:
+                    return
+                for request_id, data in _zmq_messages(frames):
+                    self._deliver(request_id, data)
+        try:
+            chunk = self.soc.recv(65536)
+        except BlockingIOError:
+            return
+        if not chunk:
+            raise ConnectionError("connection closed by the peer")
+        self._buffer += chunk
+        for request_id, payload in _pop_socket_messages(self._buffer):
+            self._deliver(request_id, pickle.loads(payload))
+
+    def _deliver(self, request_id, data):
+        self.data = data
         self.recv = True
-        self.soc.close()
-
+        self._recv_event.set()
+        future = self._pending.pop(request_id, None)
+        if future is not None:
+            # a cancelled request only loses its reply, the channel keeps serving the others
+            _set_result(future, data)
+
+    def _deliver_local(self, future, data):
+        self._local_pending.discard(future)
+        data = _message_data(data)
+        self.data = data
+        self.recv = True
+        self._recv_event.set()
+        _set_result(future, data)
+
+    def _fail_local(self, future, exc):
+        self._local_pending.discard(future)
+        _set_exception(future, exc)
+
+    def fail_pending(self, exc):
+        """Breaks the channel after an I/O error: the requests in flight and the next ones fail with exc"""
+        self._failed = exc
+        self._outbox.clear()
+        self._unsent = None
+        while self._pending:
+            _, future = self._pending.popitem()
+            _set_exception(future, exc)
+
+    def _shutdown(self):
+        self._closed = True
+        self._loop.unregister(self)
+        if self._zmq:
+            self.soc.close(linger=0)
+        else:
+            self.soc.close()
+        while self._pending:
+            _, future = self._pending.popitem()
+            future.cancel()
 
 
 class ListenThread(threading.Thread):
+    """Thread answering the requests sent to a TCP_RECV port.
+
+    The socket is bound when the thread is created, so `address` can be given to
+    the senders before the thread starts, and it serves requests until `close`.
+    Each request is exposed in `data` with `recv` and the `_recv_event` to wait
+    for it set, until the reply is given to `send_message`.
+    """
     def __init__(self, address):
-        super(ListenThread, self).__init__()
-        r = parse("tcp://{target}:{port}", address)
-        self.address = None
-        self.target = r['target']
-        self.port = r['port']
+        super(ListenThread, self).__init__(daemon=True)
+        self._log = logging.getLogger(__name__)
+        self.target, self.port = _split_address(address)
         self.data = {}
         self.recv = False
+        self._recv_event = threading.Event()
         self._send_message = None
-
+        self._send_ready = threading.Event()
+        self._closing = False
+        self._local_requests = collections.deque()
+        self._local_lock = threading.Lock()
+        self._wake_rx, self._wake_tx = socket.socketpair()
+        self._wake_tx.setblocking(False)
+        self._zmq = USE_PORT == "zmq"  # the backend can't change once the socket is bound
+        if self._zmq:
+            if not self._check_address():
+                raise ValueError("address isn't correct, it needs to be like "
+                                 "tcp://localhost:5668 or tcp://127.0.0.1:5668 ")
+            self.address = "tcp://{t}:{p}".format(t=self.target, p=self.port)
+            self._soc = _ZMQ_CTX.socket(zmq.ROUTER)
+            self._soc.bind("tcp://*:{}".format(self.port))
+        elif USE_PORT == "socket":
+            self.address = (self.target, self.port)
+            self._soc = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+            self._soc.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            self._soc.bind(self.address)
+            self._soc.listen()
+        else:
+            raise ValueError("USE_PORT needs to be zmq or socket")
+        _LOCAL_LISTENERS[self.port] = self
 
     def _check_address(self):
         if self.target == 'localhost':
             return True
         try:
-            host_bytes = self.target.split('.')
-            valid = [int(b) for b in host_bytes]
-            valid = [b for b in valid if b >= 0 and b <= 255]
-            return len(host_bytes) == 4 and len(valid) == 4
-        except:
+            # strict dotted quad, unlike inet_aton which also takes "127.1"
+            socket.inet_pton(socket.AF_INET, self.target)
+            return True
+        except OSError:
             return False
 
     #@property
@@ -240,38 +740,154 @@ class ListenThread(threading.Thread):
 
     #@send_message.setter
     def send_message(self, value):
+        # the request is answered as soon as this returns: waiting for _recv_event
+        # again must not see it any more
         self._send_message = value
-
-    def run(self):
-        if USE_PORT == "zmq":
-            if not self._check_address():
-                raise ValueError("address isn't correct, it needs to be like "
-                                 "tcp://localhost:5668 or tcp://127.0.0.1:5668 ")
-            self.address = "tcp://{t}:{p}".format(t=self.target, p=self.port)
-            context = zmq.Context()
-            s = context.socket(zmq.REP)
-            s.bind("tcp://*:{}".format(self.port))
-            self.data = pickle.loads(s.recv())
+        self.recv = False
+        self._recv_event.clear()
+        self._send_ready.set()
+
+    def submit_local(self, data, reply, fail):
+        """Queues a request coming from a sending port of this process,
+        reply(message) is called with the answer, or fail(exc) if the
+        port is closed before answering it"""
+        with self._local_lock:
+            if not self._closing:
+                self._local_requests.append((data, reply, fail))
+                self._wake()
+                return
+        fail(ConnectionError("the listening port has been closed"))
+
+    def close(self):
+        """Stops serving requests, the socket is closed by the thread"""
+        if _LOCAL_LISTENERS.get(self.port) is self:
+            del _LOCAL_LISTENERS[self.port]
+        with self._local_lock:
+            self._closing = True
+        self._send_ready.set()
+        self._wake()
+        if not self.is_alive():
+            self._close_sockets()
+
+    def _wake(self):
+        try:
+            self._wake_tx.send(b"\0")
+        except OSError:
+            pass  # the listener has not consumed the previous wake ups yet, or is closed
+
+    def _local_batch(self):
+        """Takes the requests queued by submit_local"""
+        self._wake_rx.recv(4096)
+        requests = []
+        while self._local_requests:
+            requests.append(self._local_requests.popleft())
+        return requests
+
+    def _answer(self, requests):
+        """Exposes each (data, reply, fail) request in `data` and replies with the
+        message given to send_message. fail is None for the requests of a socket"""
+        for i, (data, reply, _) in enumerate(requests):
+            self.data = _message_data(data)
             self.recv = True
-            while not self._send_message:
-                print(self._send_message)
-                time.sleep(0.001)
-            s.send(pickle.dumps(self._send_message))
-            s.close()
+            self._recv_event.set()
+            self._send_ready.wait()
+            self._send_ready.clear()
+            if self._closing:
+                self._fail_local(requests[i:])
+                return
+            try:
+                reply(self._send_message)
+            except Exception:
+                # only this request is lost, the thread keeps serving the others
+                self._log.exception("error replying to a request on port %s", self.port)
+
+    @staticmethod
+    def _fail_local(requests):
+        """Fails the requests of this process which won't be answered"""
+        exc = ConnectionError("the listening port has been closed")
+        for _, _, fail in requests:
+            if fail is not None:
+                fail(exc)
 
-        elif USE_PORT == "socket":
-            import socket
-            self.address = ('{}'.format(self.target), int(self.port))
-            s = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            s.bind(self.address)
-            s.listen(1)
-            ss, addr = s.accept()
-            self.data = pickle.loads(ss.recv(512))
-            self.recv = True
-            while not self._send_message:
-                time.sleep(0.001)
-            ss.send(pickle.dumps(self._send_message))
+    def run(self):
+        try:
+            if self._zmq:
+                self._serve_zmq()
+            else:
+                self._serve_socket()
+        finally:
+            self._close_sockets()
+
+    def _serve_zmq(self):
+        s = self._soc
+        poller = zmq.Poller()
+        poller.register(s, zmq.POLLIN)
+        poller.register(self._wake_rx.fileno(), zmq.POLLIN)
+        while not self._closing:
+            events = dict(poller.poll())
+            if self._wake_rx.fileno() in events:
+                self._answer(self._local_batch())
+            if s in events and not self._closing:
+                identity, *frames = s.recv_multipart(copy=False)
+
+                def reply_to(request_id):
+                    return lambda message: s.send_multipart(
+                        [identity] + _zmq_frames(request_id, message), copy=False)
+
+                # a sender can batch several requests in one message
+                self._answer([(data, reply_to(request_id), None)
+                              for request_id, data in _zmq_messages(frames)])
+
+    def _serve_socket(self):
+        # epoll on Linux: waits for connections, for requests on the open
+        # connections and for requests of this process
+        selector = selectors.DefaultSelector()
+        selector.register(self._soc, selectors.EVENT_READ)
+        selector.register(self._wake_rx, selectors.EVENT_READ)
+        try:
+            while not self._closing:
+                for key, _ in selector.select():
+                    if self._closing:
+                        break
+                    if key.fileobj is self._wake_rx:
+                        self._answer(self._local_batch())
+                    elif key.fileobj is self._soc:
+                        ss, addr = self._soc.accept()
+                        selector.register(ss, selectors.EVENT_READ, bytearray())
+                    else:
+                        self._read_connection(selector, key.fileobj, key.data)
+        finally:
+            for key in list(selector.get_map().values()):
+                if key.fileobj not in (self._soc, self._wake_rx):
+                    key.fileobj.close()
+            selector.close()
+
+    def _read_connection(self, selector, ss, buffer):
+        # one recv gets all the requests a sender batched, instead of two per request
+        chunk = ss.recv(65536)
+        if not chunk:
+            selector.unregister(ss)
             ss.close()
-            s.close()
+            return
+        buffer += chunk
+
+        def reply_to(request_id):
+            def reply(message):
+                payload = _dumps(message)
+                ss.sendall(_SOCKET_HEADER.pack(request_id, len(payload)) + payload)
+            return reply
+
+        self._answer([(pickle.loads(payload), reply_to(request_id), None)
+                      for request_id, payload in _pop_socket_messages(buffer)])
+
+    def _close_sockets(self):
+        if self._zmq:
+            self._soc.close(linger=0)
         else:
-            raise ValueError("USE_PORT needs to be zmq or socket")
+            self._soc.close()
+        self._wake_rx.close()
+        self._wake_tx.close()
+        with self._local_lock:
+            requests = list(self._local_requests)
+            self._local_requests.clear()
+        self._fail_local(requests)
@@ -13,9 +13,8 @@ Defines the API to implement a discoverable object
 
 """
 from enum import Enum
-import pydash
 import logging
-from communication_port import CommunicationMode, CommunicationPort
+from communication_port import CommunicationMode, CommunicationPort, SerializedMessage
 from service_interface import ServiceInterface
 
 
@@ -119,6 +118,12 @@ class DiscoveryServer(object):
         """
         self._communication_port = discovery_port
         self._data = services_data
+        # services by service_type, the first one registered wins
+        self._index = {}
+        for service_data in services_data:
+            self._index.setdefault(service_data["service_type"], service_data)
+        # the answers sent through a TCP_RECV port, pickled once by service_type
+        self._tcp_answers = {}
 
         self._communication_port.receive_callback = self.receive
 
@@ -137,23 +142,36 @@ class DiscoveryServer(object):
             return
         # print("looking for :"+str({"service_type":data["service_type"]}))
         # print(self._data)
-        res = pydash.find(self._data, {"service_type": data["service_type"]})
+        try:
+            res = self._index.get(data["service_type"])
+        except TypeError:
+            res = None  # unhashable service_type, it can't be a registered one
         if not res:
             respond_function({
                 "error": DiscoveryError.SERVICE_UNKNOWN
             })
             return
+        if respond_function == self._communication_port.receive_tcp and "service_reference" not in res:
+            res = self._tcp_answer(data["service_type"], res)
         respond_function(res)
         return
 
+    def _tcp_answer(self, service_type, res):
+        """The answer to send through the TCP_RECV port, pickled on the first request
+        for service_type instead of on each one"""
+        answer = self._tcp_answers.get(service_type)
+        if answer is None:
+            answer = self._tcp_answers[service_type] = SerializedMessage(res)
+        return answer
+
 
 from threading import Event as ThreadEvent
-import time
 
 
 class DiscoveryDelegate(object):
     def __init__(self, timeout_msec=500):
         self._ready: ThreadEvent = ThreadEvent()
+        self._timeout_msec = timeout_msec
         self._resdata: dict = None
 
     def _discovery_handle_response(self, data: dict):
@@ -193,8 +211,8 @@ class DiscoveryDelegate(object):
             "service_type": service_type
         })
         # print("sent message to discovery server")
-        while not self._ready.is_set():
-            time.sleep(0.01)
+        if not self._ready.wait(timeout=self._timeout_msec / 1000.0):
+            raise RuntimeError("discovery server did not answer within {} msec".format(self._timeout_msec))
         resport: CommunicationPort = None
         if "service_reference" in self._resdata.keys():
             resport = CommunicationPort(communication_mode=
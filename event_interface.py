@@ -17,12 +17,24 @@ File which contains the definition of the events used by the event simulator.
 
 import datetime as dt
 import logging
-import functools
 from abc import ABCMeta, abstractmethod
 
 
+_EPOCH = dt.datetime(1970, 1, 1)
+_EPOCH_UTC = dt.datetime(1970, 1, 1, tzinfo=dt.timezone.utc)
+
+
+def _timestamp(date_time):
+    """Seconds since the epoch of date_time, as a float ordered like the datetimes.
+
+    Unlike `datetime.datetime.timestamp`, a naive date_time is not converted from the
+    local time, so that DST changes can not reorder events.
+    """
+    if date_time.utcoffset() is None:
+        return (date_time - _EPOCH).total_seconds()
+    return (date_time - _EPOCH_UTC).total_seconds()
+
 
-@functools.total_ordering
 class AbstractEvent(metaclass=ABCMeta):
     """Abstract class to define an event. The instances of this
     class are totally ordered according to their
@@ -33,10 +45,19 @@ class AbstractEvent(metaclass=ABCMeta):
         date_time (datetime.datetime):
             The date_time of the event ie. when it must be executed.
 
+        _ts (float):
+            The date_time as seconds since the epoch. The events are compared on it
+            since comparing floats is much cheaper than comparing datetimes.
+
         _cancelled (bool):
             A boolean to mark the event as cancelled
     """
 
+    __slots__ = ('_date_time', '_ts', '_cancelled')
+
+    # shared by all the events, getLogger takes the logging module lock
+    _log = logging.getLogger(__name__)
+
     def __init__(self, date_time: dt.datetime):
         """Constructor for AbstractEvent
 
@@ -46,7 +67,21 @@ class AbstractEvent(metaclass=ABCMeta):
         """
         self.date_time = date_time
         self._cancelled = False
-        self._log = logging.getLogger(__name__)
+
+    @property
+    def date_time(self):
+        """datetime.datetime: The date_time of the event ie. when it must be executed."""
+        return self._date_time
+
+    @date_time.setter
+    def date_time(self, value):
+        self._date_time = value
+        self._ts = _timestamp(value)
+
+    @property
+    def timestamp(self):
+        """float: The date_time of the event as seconds since the epoch."""
+        return self._ts
 
     def __eq__(self, other):
         """Compare two events. The comparison is made on their
@@ -61,7 +96,7 @@ class AbstractEvent(metaclass=ABCMeta):
             bool:
                 True if and only if the events happen at the same date_time
         """
-        return self.date_time == other.date_time
+        return self._ts == other._ts
 
     def __lt__(self, other):
         """Compare two events. The comparison is made on their
@@ -76,7 +111,18 @@ class AbstractEvent(metaclass=ABCMeta):
             bool:
                 True if and only if the other event happen after the current event.
         """
-        return self.date_time < other.date_time
+        return self._ts < other._ts
+
+    # Defined directly rather than with functools.total_ordering, whose
+    # generated methods call __lt__ and __eq__ in turn.
+    def __le__(self, other):
+        return self._ts <= other._ts
+
+    def __gt__(self, other):
+        return self._ts > other._ts
+
+    def __ge__(self, other):
+        return self._ts >= other._ts
 
     @abstractmethod
     def execute(self, simulator):
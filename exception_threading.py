@@ -57,7 +57,6 @@ class ExceptionThread(threading.Thread):
             Do not override this method but the method `run_with_exception`!
         """
         # noinspection PyBroadException
-        print("runing thread")
         try:
             self.run_with_exception()
         except NotImplementedError as e:
@@ -15,8 +15,11 @@ Define a Priority Queue for events in which Event can be cancelled.
     PriorityQueue
 """
 
+import collections
 import heapq
-from threading import Lock as ThreadLock
+import itertools
+from queue import Full
+from threading import Condition, Lock as ThreadLock
 
 
 class PriorityQueue(object):
@@ -25,45 +28,148 @@ class PriorityQueue(object):
 
     Attributes:
         _pq (list)
-            The list of events to be executed. It is in fact a priority queue.
+            The list of events to be executed. It is in fact a priority queue of
+            (timestamp, sequence number, event) tuples: heapq compares the floats in C
+            instead of calling AbstractEvent.__lt__, and the sequence number executes the
+            events of a same date_time in the order they were pushed.
+
+        _seq (itertools.count):
+            The sequence numbers of the pushed events.
+
+        _inbound (collections.deque):
+            The entries pushed and not yet moved to `_pq`. `push` appends to it without taking
+            `_pq_lock` (a deque append is atomic), so the producers do not contend on the lock
+            with the consumer; the next operation holding the lock moves them to the heap.
 
         _pq_lock (threading.Lock):
             A thread lock to access to the list of events.
 
+        _not_empty (threading.Condition):
+            Condition of `_pq_lock` notified when events are pushed, for the blocking `pop`.
+
+        _waiting (int):
+            The number of threads blocked in `pop`, `push` only takes the lock to notify them.
+
+        _maxsize (int):
+            The maximum number of events in the queue, 0 for no limit. When it is reached
+            `push` blocks or raises queue.Full. The events cancelled by `cancel` do not count,
+            the ones cancelled with AbstractEvent.cancel() keep their slot until they reach
+            the top of the heap or the heap is rebuilt.
+
+        _not_full (threading.Condition):
+            Condition of `_pq_lock` notified when events are popped or cancelled, for the
+            blocking `push` of a bounded queue.
+
+        _tombstones (set):
+            The sequence numbers of the events cancelled by `cancel` still stored in `_pq`.
+            When they are more than the half of it, the heap is rebuilt without them.
+
+        _popped (bool):
+            True when the top of `_pq` has been returned by `pop` but is still in the heap.
+            Its removal is deferred to the next operation: a pushed entry replaces it with a
+            single `heapreplace` (one sift-down) instead of a `heappop` and a `heappush`.
+
     See Also:
         :py:mod:`heapq`
         :py:class:`threading.Lock`
     """
 
-    def __init__(self):
-        """Constructor for PriorityQueue"""
+    def __init__(self, maxsize=0):
+        """Constructor for PriorityQueue
+
+        Args:
+            maxsize (int):
+                The maximum number of events in the queue, 0 (default) for no limit.
+        """
         self._pq = list()
+        self._inbound = collections.deque()
         self._pq_lock = ThreadLock()
+        self._not_empty = Condition(self._pq_lock)
+        self._waiting = 0
+        self._maxsize = maxsize
+        self._not_full = Condition(self._pq_lock)
+        self._seq = itertools.count()
+        self._tombstones = set()
+        self._popped = False
 
-    def push(self, event):
+    def push(self, event, block=True, timeout=None):
         """Push an event in the priority queue.
 
         Args:
             event (AbstractEvent):
                 The event to add.
+            block (bool):
+                If the queue is bounded and full, wait for a free slot if True (default),
+                else raise queue.Full.
+            timeout (float):
+                With block, the maximum number of seconds to wait. None waits forever.
+
+        Raises:
+            queue.Full: if the queue is full, with block when the timeout expired.
         """
-        with self._pq_lock:
-            heapq.heappush(self._pq, event)
+        entry = (event.timestamp, next(self._seq), event)
+        if self._maxsize > 0:
+            with self._pq_lock:
+                if not self._has_room() and (
+                        not block or not self._not_full.wait_for(self._has_room, timeout)):
+                    raise Full
+                self._inbound.append(entry)
+                self._not_empty.notify()
+            return
+        self._inbound.append(entry)
+        # a consumer increments _waiting before looking at _inbound a last time
+        # and waiting, so either it sees this event or it is notified
+        if self._waiting:
+            with self._not_empty:
+                self._not_empty.notify()
+
+    def push_many(self, events):
+        """Push several events in the priority queue at once, they are moved to
+        the heap together.
+
+        Args:
+            events (Iterable[AbstractEvent]):
+                The events to add. The events of a same date_time are executed in
+                the order of the iterable.
+        """
+        if self._maxsize > 0:
+            for event in events:
+                self.push(event)
+            return
+        entries = [(event.timestamp, next(self._seq), event) for event in events]
+        self._inbound.extend(entries)
+        if self._waiting:
+            with self._not_empty:
+                self._not_empty.notify(len(entries))
 
-    def pop(self):
+    def pop(self, block=False, timeout=None):
         """Pop the next events which is not cancelled.
 
+        Args:
+            block (bool):
+                If True, wait for an event to be pushed when the queue is empty
+                instead of raising IndexError.
+            timeout (float):
+                With block, the maximum number of seconds to wait. None waits forever.
+
         Returns:
             AbstractEvent:
                 The next event which has not been cancelled.
 
         Raises:
-            IndexError: if the heap is empty (no more event).
+            IndexError: if the heap is empty (no more event), with block when the timeout expired.
         """
-        with self._pq_lock:
-            event = heapq.heappop(self._pq)  # type: AbstractEvent
-            while event.cancelled:
-                event = heapq.heappop(self._pq)  # type: AbstractEvent
+        with self._not_empty:
+            if not self._has_next() and block:
+                self._waiting += 1
+                try:
+                    self._not_empty.wait_for(self._has_next, timeout)
+                finally:
+                    self._waiting -= 1
+            event = self._pq[0][2]
+            self._popped = True
+            if self._maxsize > 0:
+                self._not_full.notify()
             return event
 
     def empty(self):
@@ -75,10 +181,63 @@ class PriorityQueue(object):
                 True if and only if the priority queue is empty.
         """
         with self._pq_lock:
-            for e in self._pq:  # type: AbstractEvent
-                if not e.cancelled:
-                    return False
-            return True
+            return not self._has_next()
+
+    def _has_room(self):
+        """Returns True if an event can be pushed in the bounded queue. The events
+        cancelled by `cancel` are not counted. The caller must hold `_pq_lock`."""
+        self._has_next()  # frees the slots of the cancelled events at the top
+        size = len(self._pq) + len(self._inbound) - self._popped - len(self._tombstones)
+        return size < self._maxsize
+
+    def _has_next(self):
+        """Returns True if there is an event to pop, which is then at the top of
+        the heap. The caller must hold `_pq_lock`."""
+        self._settle()
+        self._drop_cancelled_top()
+        return bool(self._pq)
+
+    def _settle(self):
+        """Move the pushed entries to the heap and remove the event returned by the
+        last `pop` if it is still in the heap. The caller must hold `_pq_lock`."""
+        inbound = self._inbound
+        if inbound:
+            # only the entries already there: the producers keep appending meanwhile
+            self._add_entries([inbound.popleft() for _ in range(len(inbound))])
+        if self._popped:
+            self._popped = False
+            heapq.heappop(self._pq)
+
+    def _add_entries(self, entries):
+        """Add entries to the heap. The caller must hold `_pq_lock`.
+
+        A batch at least as large as the heap is added with one `heapify` (O(n + k)),
+        a smaller one with a `heappush` per entry. A pushed entry is usually later
+        than most of the heap and only sifts up a level or two, so the heappushes
+        stay faster up to a batch about the size of the heap with random dates, and
+        beyond with dates after the ones in the heap.
+        """
+        pq = self._pq
+        if self._popped:
+            self._popped = False
+            heapq.heapreplace(pq, entries.pop())
+        if len(entries) >= len(pq):
+            pq.extend(entries)
+            heapq.heapify(pq)
+        else:
+            for entry in entries:
+                heapq.heappush(pq, entry)
+
+    def _drop_cancelled_top(self):
+        """Pop the cancelled events from the top of the heap, so that the top is the
+        next event to execute. The caller must hold `_pq_lock`.
+
+        A cancelled event is never returned by `pop`, dropping it here is only done
+        earlier. It makes `empty` amortized O(1) instead of a scan of the whole queue.
+        """
+        pq = self._pq
+        while pq and pq[0][2].cancelled:
+            self._tombstones.discard(heapq.heappop(pq)[1])
 
     def cancel(self, key):
         """Cancel all events `e` which satisfies `key(e)`.
@@ -90,16 +249,33 @@ class PriorityQueue(object):
 
         Returns:
             List[AbstractEvent]:
-                List of cancelled events.
+                List of cancelled events, the ones cancelled before are not in it.
+
+        Note:
+            The events are only marked as cancelled, like tombstones: the heap is not
+            modified until they are more than half of it.
         """
         le = list()
         with self._pq_lock:
-            for e in self._pq:  # type: AbstractEvent
-                if key(e):
+            self._settle()
+            for _, seq, e in self._pq:  # type: AbstractEvent
+                if not e.cancelled and key(e):
                     e.cancel()
                     le.append(e)
+                    self._tombstones.add(seq)
+            if len(self._tombstones) > len(self._pq) // 2:
+                self._compact()
+            if self._maxsize > 0 and le:
+                self._not_full.notify(len(le))
         return le
 
+    def _compact(self):
+        """Rebuild the heap without its cancelled events, so that the cancelled events do not
+        make each `pop` skip them one by one. The caller must hold `_pq_lock`."""
+        self._pq = [entry for entry in self._pq if not entry[2].cancelled]
+        heapq.heapify(self._pq)
+        self._tombstones.clear()
+
     def contains(self, key):
         """Answer `True` if their is at least an event `e` which satisfies `key(e)` in the priority queue.
 
@@ -111,10 +287,12 @@ class PriorityQueue(object):
         Returns:
             bool:
                 True if the event contains  at least an event `e` which satisfies `key(e)`.
+                The cancelled events are ignored.
         """
         with self._pq_lock:
-            for e in self._pq:  # type: AbstractEvent
-                if key(e):
+            self._settle()
+            for _, _, e in self._pq:  # type: AbstractEvent
+                if not e.cancelled and key(e):
                     break
             else:
                 return False
@@ -134,11 +312,12 @@ class PriorityQueue(object):
 
         Returns:
             List[AbstractEvent]:
-                List of events `e` which satisfies `key(e)`.
+                List of events `e` which satisfies `key(e)`, except the cancelled ones.
         """
         le = list()
         with self._pq_lock:
-            for e in self._pq:  # type: AbstractEvent
-                if key(e):
+            self._settle()
+            for _, _, e in self._pq:  # type: AbstractEvent
+                if not e.cancelled and key(e):
                     le.append(e)
         return le
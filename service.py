@@ -35,7 +35,7 @@ class Service(ExceptionThread,ServiceInterface):
     """
 
     def __init__(self, service_mode: ServiceMode
-                 ,exit_callback=None):
+                 ,exit_callback=None, maxsize=0):
         """
         Arguments
             service_mode : Enum types to ensure the user of the class understands the setting
@@ -46,24 +46,32 @@ class Service(ExceptionThread,ServiceInterface):
                            - In SYNC Mode the event is processed when added
                            => for instance the client can run in SYNC mode if the simulator manages
                            the delaying of Events to play them at the right date
+            maxsize : In ASYNC mode, the maximum number of events in the queue, 0 for no limit.
+                      When it is reached add_event blocks until the service pops an event,
+                      or raises queue.Full when it is called from the service thread itself.
+                      See PriorityQueue for how the cancelled events are counted
         """
         ExceptionThread.__init__(self, name="ServiceThread", daemon=False)
-        self._service_mode = service_mode
-        # Some exit callbacks which are called at the end of the simulation
-        self._exit_callback = exit_callback
+        ServiceInterface.__init__(self, service_mode, exit_callback=exit_callback)
 
         self._event_queue: PriorityQueue = None
-        if self.is_async:
-            self._event_queue = PriorityQueue()
-
+        if self._is_async:
+            self._event_queue = PriorityQueue(maxsize)
+        # the mode can't change: add_event is bound once to the method of the mode,
+        # unless a subclass overrides it or the queue is bounded (see add_event)
+        if type(self).add_event is Service.add_event:
+            if not self._is_async:
+                self.add_event = self.process_event
+            elif maxsize <= 0:
+                self.add_event = self._event_queue.push
 
     def start(self):
         """Call to start the Thread IF in ASYNC mode
         overrides the Thread method to check 
         if it should be called or not"""
-        if not self.is_async:
+        if not self._is_async:
             raise RuntimeError
-        print("starting thread")
+        logger.debug("starting %s", self.name)
         ExceptionThread.start(self)
 
     def add_event(self, event: AbstractEvent):
@@ -73,10 +81,13 @@ class Service(ExceptionThread,ServiceInterface):
         Args:
             event (AbstractEvent):
                 The event to add to the current simulator.
+
+        Raises:
+            queue.Full: if the queue is bounded and full and this is called from the
+                service thread, which would otherwise wait for itself to pop an event.
         """
-        if self.is_async:
-            print("push")
-            self._event_queue.push(event)
+        if self._is_async:
+            self._event_queue.push(event, block=current_thread_ident() != self.ident)
         else:
             self.process_event(event)
 
@@ -46,13 +46,15 @@ class ServiceInterface(metaclass=ABCMeta):
                            the delaying of Events to play them at the right date
         """
         self._service_mode = service_mode
+        # computed once, add_event checks it for every event
+        self._is_async = service_mode is ServiceMode.ASYNC
         # Some exit callbacks which are called at the end of the simulation
         self._exit_callback = exit_callback
 
     @property
     def is_async(self):
         """returns True if the service has been created in async mode"""
-        return self._service_mode == ServiceMode.ASYNC
+        return self._is_async
 
     def start(self):
         """Call to start the Thread IF in ASYNC mode
@@ -13,9 +13,13 @@ Test for comunication ports
 """
 
 import unittest
+import pickle
+import socket
+import time
 from nose.tools import nottest
+import zmq
+import communication_port
 from communication_port import CommunicationMode, CommunicationPort
-import time
 
 
 class TestCommunicationPort(unittest.TestCase):
@@ -75,15 +79,213 @@ class TestCommunicationPort(unittest.TestCase):
         port_a.target_port = port_b.task.address
         data_a = {"test":"ok_a"}
         port_a.send(data_a)
-        while not port_b.task.recv:
-            time.sleep(0.001)
+        self.assertTrue(port_b.task._recv_event.wait(1.0))
         port_b.receive(port_b.task.data, respond_function=port_b.receive_tcp)
         self.assertEqual(self.data_b, data_a)
-        while not port_a.recv:
-            time.sleep(0.001)
+        self.assertTrue(port_a.task._recv_event.wait(1.0))
         port_a.receive(port_a.task.data)
         self.assertEqual(self.data_a, TestCommunicationPort.RESPONSE_MSG)
 
+    def test_tcp_pipelined_requests(self):
+        """answer several in-flight requests back to back"""
+        port_a = CommunicationPort(CommunicationMode.TCP_SEND)
+        port_b = CommunicationPort(CommunicationMode.TCP_RECV, target_address="tcp://localhost:5669")
+        port_b.task.start()
+        port_a.target_port = port_b.task.address
+        try:
+            futures = [port_a.send({"test":i}) for i in range(3)]
+            for _ in range(3):
+                self.assertTrue(port_b.task._recv_event.wait(1.0))
+                port_b.task.send_message({"response":port_b.task.data["test"]})
+            self.assertEqual([f.result(1.0) for f in futures],
+                             [{"response":0}, {"response":1}, {"response":2}])
+        finally:
+            port_a.close()
+            port_b.close()
+
+    def test_tcp_wire(self):
+        """batched requests and out-of-band buffers through the sockets, not the
+        in-process shortcut"""
+        communication_port.USE_LOCAL_SHORTCUT = False
+        try:
+            port_a = CommunicationPort(CommunicationMode.TCP_SEND)
+            port_b = CommunicationPort(CommunicationMode.TCP_RECV, target_address="tcp://localhost:5671")
+            port_b.task.start()
+            port_a.target_port = port_b.task.address
+        finally:
+            communication_port.USE_LOCAL_SHORTCUT = True
+        try:
+            self.assertIsNone(port_a.task._local)
+            payload = bytearray(b"x" * 100000)
+            futures = port_a.send_batch([{"test":i, "buf":pickle.PickleBuffer(payload)}
+                                         for i in range(3)])
+            for _ in range(3):
+                self.assertTrue(port_b.task._recv_event.wait(1.0))
+                data = port_b.task.data
+                # received out-of-band: a view of the zmq frame
+                self.assertIsInstance(data["buf"], memoryview)
+                self.assertEqual(bytes(data["buf"]), bytes(payload))
+                port_b.task.send_message({"response":data["test"],
+                                          "buf":pickle.PickleBuffer(bytearray(b"y" * 10))})
+            results = [f.result(1.0) for f in futures]
+            self.assertEqual([r["response"] for r in results], [0, 1, 2])
+            self.assertEqual([bytes(r["buf"]) for r in results], [b"y" * 10] * 3)
+        finally:
+            port_a.close()
+            port_b.close()
+
+    def test_cancelled_request(self):
+        """the late reply of a cancelled request does not break the port"""
+        communication_port.USE_LOCAL_SHORTCUT = False
+        try:
+            port_a = CommunicationPort(CommunicationMode.TCP_SEND)
+            port_b = CommunicationPort(CommunicationMode.TCP_RECV, target_address="tcp://localhost:5672")
+            port_b.task.start()
+            port_a.target_port = port_b.task.address
+        finally:
+            communication_port.USE_LOCAL_SHORTCUT = True
+        try:
+            futures = [port_a.send({"test":i}) for i in range(2)]
+            self.assertTrue(futures[0].cancel())
+            for _ in range(2):
+                self.assertTrue(port_b.task._recv_event.wait(1.0))
+                port_b.task.send_message({"response":port_b.task.data["test"]})
+            self.assertEqual(futures[1].result(1.0), {"response":1})
+            future = port_a.send({"test":2})
+            self.assertTrue(port_b.task._recv_event.wait(1.0))
+            port_b.task.send_message({"response":2})
+            self.assertEqual(future.result(1.0), {"response":2})
+        finally:
+            port_a.close()
+            port_b.close()
+
+    def test_cancelled_local_request(self):
+        """a cancelled request through the in-process shortcut does not stop the listener"""
+        port_a = CommunicationPort(CommunicationMode.TCP_SEND)
+        port_b = CommunicationPort(CommunicationMode.TCP_RECV, target_address="tcp://localhost:5673")
+        port_b.task.start()
+        port_a.target_port = port_b.task.address
+        try:
+            self.assertIsNotNone(port_a.task._local)
+            future = port_a.send({"test":0})
+            self.assertTrue(future.cancel())
+            self.assertTrue(port_b.task._recv_event.wait(1.0))
+            port_b.task.send_message({"response":0})
+            future = port_a.send({"test":1})
+            self.assertTrue(port_b.task._recv_event.wait(1.0))
+            port_b.task.send_message({"response":1})
+            self.assertEqual(future.result(1.0), {"response":1})
+        finally:
+            port_a.close()
+            port_b.close()
+
+    def test_closed_local_listener(self):
+        """the local requests fail when the listener closes and go to the one replacing it"""
+        address = "tcp://localhost:5674"
+        port_a = CommunicationPort(CommunicationMode.TCP_SEND)
+        port_b = CommunicationPort(CommunicationMode.TCP_RECV, target_address=address)
+        port_b.task.start()
+        port_a.target_port = port_b.task.address
+        try:
+            future = port_a.send({"test":0})
+            self.assertTrue(port_b.task._recv_event.wait(1.0))
+            port_b.close()
+            port_b.task.join(1.0)
+            self.assertIsInstance(future.exception(1.0), ConnectionError)
+            # zmq releases the address of a closed socket asynchronously
+            for _ in range(100):
+                try:
+                    port_c = CommunicationPort(CommunicationMode.TCP_RECV, target_address=address)
+                    break
+                except zmq.ZMQError:
+                    time.sleep(0.01)
+            port_c.task.start()
+            try:
+                future = port_a.send({"test":1})
+                self.assertTrue(port_c.task._recv_event.wait(1.0))
+                port_c.task.send_message({"response":1})
+                self.assertEqual(future.result(1.0), {"response":1})
+                # closing the sending port cancels its requests
+                future = port_a.send({"test":2})
+                port_a.close()
+                self.assertTrue(future.cancelled())
+            finally:
+                port_c.close()
+        finally:
+            port_a.close()
+            port_b.close()
+
+    def test_broken_port(self):
+        """after an I/O error the requests fail instead of waiting forever"""
+        unused = socket.socket()
+        unused.bind(("127.0.0.1", 0))
+        address = unused.getsockname()
+        unused.close()
+        communication_port.USE_PORT = "socket"
+        try:
+            port_a = CommunicationPort(CommunicationMode.TCP_SEND)
+        finally:
+            communication_port.USE_PORT = "zmq"
+        try:
+            port_a.target_port = address
+            future = port_a.send({"test":0})
+            self.assertIsInstance(future.exception(2.0), ConnectionRefusedError)
+            future = port_a.send({"test":1})
+            self.assertIsInstance(future.exception(0), ConnectionRefusedError)
+        finally:
+            port_a.close()
+
+    def test_non_tcp_endpoint(self):
+        """zmq endpoints other than tcp:// are connected to directly"""
+        peer = zmq.Context.instance().socket(zmq.ROUTER)
+        peer.bind("inproc://test_non_tcp_endpoint")
+        port_a = CommunicationPort(CommunicationMode.TCP_SEND)
+        try:
+            port_a.target_port = "inproc://test_non_tcp_endpoint"
+            port_a.send({"test":"ok_a"})
+            self.assertTrue(peer.poll(2000))
+        finally:
+            port_a.close()
+            peer.close(linger=0)
+
+    def test_socket_backend_address(self):
+        """with the "socket" backend the listener address is a (host, port) tuple"""
+        communication_port.USE_PORT = "socket"
+        try:
+            port_a = CommunicationPort(CommunicationMode.TCP_SEND)
+            port_b = CommunicationPort(CommunicationMode.TCP_RECV, target_address="tcp://localhost:5670")
+        finally:
+            # the ports keep the backend they were created with
+            communication_port.USE_PORT = "zmq"
+        port_b.task.start()
+        try:
+            self.assertEqual(port_b.task.address, ("localhost", 5670))
+            port_a.target_port = port_b.task.address
+            future = port_a.send({"test":"ok_a"})
+            self.assertTrue(port_b.task._recv_event.wait(1.0))
+            port_b.task.send_message(TestCommunicationPort.RESPONSE_MSG)
+            self.assertEqual(future.result(1.0), TestCommunicationPort.RESPONSE_MSG)
+        finally:
+            port_a.close()
+            port_b.close()
+            port_b.task.join(1.0)
+
+    def test_unconnected_port_does_not_block_others(self):
+        """a request sent before target_port is set waits without stalling the other ports"""
+        peer = zmq.Context.instance().socket(zmq.ROUTER)
+        peer_port = peer.bind_to_random_port("tcp://127.0.0.1")
+        port_c = CommunicationPort(CommunicationMode.TCP_SEND)
+        port_d = CommunicationPort(CommunicationMode.TCP_SEND)
+        try:
+            port_c.send({"test":"ok_c"})
+            port_d.target_port = "tcp://127.0.0.1:{}".format(peer_port)
+            port_d.send({"test":"ok_d"})
+            self.assertTrue(peer.poll(2000))
+        finally:
+            port_c.close()
+            port_d.close()
+            peer.close(linger=0)
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -13,6 +13,7 @@ Test for comunication ports
 
 import unittest
 from nose.tools import nottest
+import communication_port
 from communication_port import CommunicationMode, CommunicationPort
 from discovery import DiscoveryServer, DiscoveryDelegate, ServiceType, DiscoveryError
 
@@ -32,15 +33,15 @@ class TestDiscovery(unittest.TestCase):
         self.data_b = None
         self.allocator_received_data = None
 #setup discoserver
-        self.service_direct = CommunicationPort(CommunicationMode.FUNCTION_CALL)
+        self.service_direct = CommunicationPort(CommunicationMode.FUNCTION_CALL_RECV)
         self.service_direct.port_name="service_direct"
         self.service_direct.receive_callback = self.service_direct_receive_clbk
 
-        self.allocator_port = CommunicationPort(CommunicationMode.FUNCTION_CALL)
+        self.allocator_port = CommunicationPort(CommunicationMode.FUNCTION_CALL_RECV)
         self.allocator_port.port_name="allocator_port"
         self.allocator_port.receive_callback = self.allocator_port_callback
 
-        self.port_disco = CommunicationPort(CommunicationMode.FUNCTION_CALL)
+        self.port_disco = CommunicationPort(CommunicationMode.FUNCTION_CALL_RECV)
         self.port_disco.port_name="port_disco"
         self.service_tcp_info = {"service_type":"servicetcp",
             "tcp_port":"tcp://localhost:8888"}
@@ -61,7 +62,7 @@ class TestDiscovery(unittest.TestCase):
     def test_simple_direct_call(self):
         """write from port a to port b"""
 
-        port_source = CommunicationPort(CommunicationMode.FUNCTION_CALL)
+        port_source = CommunicationPort(CommunicationMode.FUNCTION_CALL_SEND)
         port_source.receive_callback = self.calback_response
         port_source.target_port = self.port_disco
         port_source.port_name="port_source"
@@ -79,6 +80,58 @@ class TestDiscovery(unittest.TestCase):
         port_source.send(data_a)
         self.assertEqual(self.data_b, {"error":DiscoveryError.MISSING_KEY_IN_REQUEST})
 
+    def test_first_service_of_a_type_wins(self):
+        """the services are looked up by service_type, the first registered answers"""
+        other_tcp_info = {"service_type":"servicetcp",
+            "tcp_port":"tcp://localhost:9999"}
+        port_disco = CommunicationPort(CommunicationMode.FUNCTION_CALL_RECV)
+        DiscoveryServer([self.service_tcp_info, other_tcp_info],
+            discovery_port=port_disco)
+
+        port_source = CommunicationPort(CommunicationMode.FUNCTION_CALL_SEND)
+        port_source.receive_callback = self.calback_response
+        port_source.target_port = port_disco
+        port_source.send({"service_type":"servicetcp"})
+        self.assertEqual(self.data_b, self.service_tcp_info)
+
+    def test_unhashable_service_type(self):
+        """a request with an unhashable service_type is answered SERVICE_UNKNOWN"""
+        port_source = CommunicationPort(CommunicationMode.FUNCTION_CALL_SEND)
+        port_source.receive_callback = self.calback_response
+        port_source.target_port = self.port_disco
+        port_source.send({"service_type":["servicetcp"]})
+        self.assertEqual(self.data_b, {"error":DiscoveryError.SERVICE_UNKNOWN})
+
+    def test_respond_function_gets_a_dict(self):
+        """any respond_function is answered the registered dict"""
+        answers = []
+        self.disco_srv.receive({"service_type":"servicetcp"}, respond_function=answers.append)
+        self.assertEqual(answers, [self.service_tcp_info])
+        self.assertIsInstance(answers[0], dict)
+
+    def test_tcp_discovery_server(self):
+        """the answers sent through a TCP_RECV port are pickled once"""
+        communication_port.USE_LOCAL_SHORTCUT = False
+        try:
+            port_disco = CommunicationPort(CommunicationMode.TCP_RECV,
+                target_address="tcp://localhost:5675")
+            port_disco.task.start()
+            port_source = CommunicationPort(CommunicationMode.TCP_SEND)
+            port_source.target_port = port_disco.task.address
+        finally:
+            communication_port.USE_LOCAL_SHORTCUT = True
+        port_disco.receive_callback_tcp = self.calback_response
+        disco_srv = DiscoveryServer([self.service_tcp_info], discovery_port=port_disco)
+        try:
+            for _ in range(2):
+                future = port_source.send({"service_type":"servicetcp"})
+                self.assertTrue(port_disco.task._recv_event.wait(1.0))
+                port_disco.receive(port_disco.task.data, respond_function=port_disco.receive_tcp)
+                self.assertEqual(future.result(1.0), self.service_tcp_info)
+            self.assertEqual(list(disco_srv._tcp_answers), ["servicetcp"])
+        finally:
+            port_source.close()
+            port_disco.close()
 
     def test_discovery_delegate(self):
         dd = DiscoveryDelegate()
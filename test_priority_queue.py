@@ -0,0 +1,138 @@
+"""
+Test Priority Queue
+-------------------
+
+Tests for the priority queue of events
+
+.. currentmodule:: simulec.event_simulator.test.test_priority_queue
+
+.. autosummary::
+    :nosignatures:
+
+    TestPriorityQueue
+"""
+
+import unittest
+import datetime as dt
+import heapq
+import queue
+import random
+import threading
+from priority_queue import PriorityQueue
+from event_interface import AbstractEvent
+
+
+DATE = dt.datetime(2020, 1, 1)
+
+
+class DummyEvent(AbstractEvent):
+    __slots__ = ('name',)
+    def __init__(self, seconds, name):
+        super(DummyEvent, self).__init__(date_time=DATE + dt.timedelta(seconds=seconds))
+        self.name = name
+    def execute(self, simulator):
+        pass
+
+
+class TestPriorityQueue(unittest.TestCase):
+    def test_pop_in_date_order(self):
+        pq = PriorityQueue()
+        for seconds in (3, 1, 2):
+            pq.push(DummyEvent(seconds, seconds))
+        self.assertEqual([pq.pop().name for _ in range(3)], [1, 2, 3])
+        self.assertTrue(pq.empty())
+        self.assertRaises(IndexError, pq.pop)
+
+    def test_same_date_in_push_order(self):
+        pq = PriorityQueue()
+        for name in range(10):
+            pq.push(DummyEvent(0, name))
+        pq.push_many([DummyEvent(0, name) for name in range(10, 20)])
+        self.assertEqual([pq.pop().name for _ in range(20)], list(range(20)))
+
+    def test_push_after_pop(self):
+        """the event popped stays at the top of the heap until the next operation"""
+        pq = PriorityQueue()
+        pq.push(DummyEvent(1, "a"))
+        pq.push(DummyEvent(3, "c"))
+        self.assertEqual(pq.pop().name, "a")
+        self.assertTrue(pq._popped)
+        # the pushed event replaces the popped one when it is moved to the heap
+        pq.push(DummyEvent(2, "b"))
+        self.assertFalse(pq.empty())
+        self.assertFalse(pq._popped)
+        self.assertEqual(len(pq._pq), 2)
+        self.assertEqual(pq.pop().name, "b")
+        self.assertEqual(pq.pop().name, "c")
+        self.assertTrue(pq.empty())
+
+    def test_cancel_contains_get_after_pop(self):
+        pq = PriorityQueue()
+        for name in ("a", "b", "c"):
+            pq.push(DummyEvent(0, name))
+        self.assertEqual(pq.pop().name, "a")
+        self.assertFalse(pq.contains(lambda e: e.name == "a"))
+        self.assertEqual([e.name for e in pq.get(lambda e: True)], ["b", "c"])
+        cancelled = pq.cancel(lambda e: e.name == "b")
+        self.assertEqual([e.name for e in cancelled], ["b"])
+        # already cancelled events are skipped
+        self.assertEqual(pq.cancel(lambda e: e.name == "b"), [])
+        self.assertFalse(pq.contains(lambda e: e.name == "b"))
+        self.assertEqual(pq.get(lambda e: e.name == "b"), [])
+        self.assertEqual(pq.pop().name, "c")
+        self.assertTrue(pq.empty())
+
+    def test_interleaved_push_pop_cancel(self):
+        """compares random operations with a heapq of the same entries"""
+        rand = random.Random(0)
+        pq = PriorityQueue()
+        model = []
+        for name in range(2000):
+            action = rand.random()
+            if action < 0.5:
+                event = DummyEvent(rand.randint(0, 50), name)
+                pq.push(event)
+                heapq.heappush(model, (event.timestamp, name, event))
+            elif action < 0.9:
+                while model and model[0][2].cancelled:
+                    heapq.heappop(model)
+                if model:
+                    self.assertIs(pq.pop(), heapq.heappop(model)[2])
+                else:
+                    self.assertRaises(IndexError, pq.pop)
+            else:
+                mod = rand.randint(2, 7)
+                expected = {e.name for _, _, e in model if not e.cancelled and e.name % mod == 0}
+                cancelled = pq.cancel(lambda e: e.name % mod == 0)
+                self.assertEqual({e.name for e in cancelled}, expected)
+
+    def test_blocking_pop(self):
+        pq = PriorityQueue()
+        self.assertRaises(IndexError, pq.pop, block=True, timeout=0.05)
+        event = DummyEvent(0, "a")
+        timer = threading.Timer(0.05, pq.push, args=(event,))
+        timer.start()
+        self.assertIs(pq.pop(block=True, timeout=2.0), event)
+        timer.join()
+
+    def test_bounded_push(self):
+        pq = PriorityQueue(maxsize=2)
+        b = DummyEvent(1, "b")
+        c = DummyEvent(2, "c")
+        pq.push(b)
+        pq.push(c)
+        self.assertRaises(queue.Full, pq.push, DummyEvent(3, "d"), block=False)
+        self.assertRaises(queue.Full, pq.push, DummyEvent(3, "d"), timeout=0.05)
+        # popping or cancelling frees a slot
+        self.assertEqual(pq.pop().name, "b")
+        pq.push(DummyEvent(3, "d"), block=False)
+        pq.cancel(lambda e: e.name == "d")
+        pq.push(DummyEvent(4, "e"), block=False)
+        # an event cancelled directly frees its slot once at the top of the heap
+        c.cancel()
+        pq.push(DummyEvent(5, "f"), block=False)
+        self.assertEqual([pq.pop().name for _ in range(2)], ["e", "f"])
+
+
+if __name__ == '__main__':
+    unittest.main()
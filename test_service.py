@@ -14,6 +14,7 @@ import unittest
 from nose.tools import nottest
 import datetime as dt
 import time
+import queue
 from ..communication.communication_port import CommunicationMode, CommunicationPort
 from ..communication.discovery import DiscoveryError, DiscoveryServer
 from ..service.service import Service
@@ -30,20 +31,31 @@ class DummyService(Service):
     def run_with_exception(self):
         while True:
             try:
-                ev = self._event_queue.pop()
+                ev = self._event_queue.pop(block=True)
                 self.process_event(ev)
-            except IndexError:
-                time.sleep(0.01)
             except StopDummyServiceException:
                 break
     def process_event(self, event: AbstractEvent):
         event.execute()
+class SelfFeedingService(DummyService):
+    """adds events to its own bounded queue until it is full"""
+    def __init__(self):
+        Service.__init__(self, service_mode=ServiceMode.ASYNC, maxsize=1)
+        self.full = False
+    def run_with_exception(self):
+        try:
+            while True:
+                self.add_event(StopEvent())
+        except queue.Full:
+            self.full = True
 class StopEvent(AbstractEvent):
+    __slots__ = ()
     def __init__(self):
         super(StopEvent, self).__init__(date_time=dt.datetime.now())
     def execute(self):
         raise StopDummyServiceException
 class DummyEvent(AbstractEvent):
+    __slots__ = ('name', 'executed')
     def __init__(self, name: str):
         super(DummyEvent, self).__init__(date_time=dt.datetime.now())
         self.name=name
@@ -74,5 +86,12 @@ class TestService(unittest.TestCase):
         time.sleep(0.5)
         self.assertFalse(ds.is_alive())
         ds.join()
+    def test_bounded_add_from_service_thread(self):
+        ds = SelfFeedingService()
+        ds.start()
+        # the service thread gets queue.Full instead of waiting for itself
+        ds.join(1.0)
+        self.assertFalse(ds.is_alive())
+        self.assertTrue(ds.full)
 if __name__ == '__main__':
     unittest.main()